@@ -3,12 +3,26 @@ AI Course Generator Backend
 Flask server with Gemini AI integration for comprehensive course generation
 """
 
+import copy
+import hashlib
+import html
+import io
 import os
+import re
+import sqlite3
+import sys
 import time
 import logging
+import threading
+import uuid
+import itertools
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import google.generativeai as genai
 from pptx import Presentation
@@ -33,11 +47,6 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Global variables for rate limiting
-last_request_time = 0
-request_count_per_minute = 0
-minute_start_time = time.time()
-
 # Create directories
 UPLOAD_FOLDER = 'generated_files'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -46,34 +55,194 @@ print("Starting AI Course Generator backend...")
 print(f"Files directory: {UPLOAD_FOLDER}")
 print("Server will be available at http://localhost:5000")
 
-def rate_limit_decorator(func):
-    """Decorator to implement rate limiting for API calls"""
-    def wrapper(*args, **kwargs):
-        global last_request_time, request_count_per_minute, minute_start_time
-        
-        current_time = time.time()
-        
-        # Reset counter every minute
-        if current_time - minute_start_time > 60:
-            request_count_per_minute = 0
-            minute_start_time = time.time()
-        
-        # Minimum delay between requests (4 seconds for free tier)
-        time_since_last = current_time - last_request_time
-        if time_since_last < 4:
-            time.sleep(4 - time_since_last)
-        
-        request_count_per_minute += 1
-        last_request_time = time.time()
-        
-        return func(*args, **kwargs)
+# Request scheduling
+
+MIN_REQUEST_INTERVAL = 4  # Seconds between model calls (free tier)
+PRIORITY_WEIGHTS = {"interactive": 8, "bulk": 1}
+DEFAULT_DEADLINES = {"interactive": 60, "bulk": 900}  # Longest acceptable queue wait
+
+class SchedulerRejected(Exception):
+    """Raised when a request cannot start before its deadline"""
+
+    def __init__(self, message: str, expected_wait: float):
+        super().__init__(message)
+        self.expected_wait = expected_wait
+
+class GenerationScheduler:
+    """
+    Paces model calls with weighted fair queuing across tenants.
+
+    Each (tenant, priority) pair is a flow. A request reserves a slot in its
+    flow with a virtual finish tag (self-clocked fair queuing) of
+    max(virtual time, flow's last tag) + 1 / weight, and start slots, one every
+    min_interval seconds, go to the flow holding the smallest tag. A tenant
+    scripting bulk requests therefore only delays others by its fair share,
+    and interactive requests (higher weight) overtake queued bulk work.
+    Within a flow, each session has its own sub-queue and the flow's slot goes
+    to the session that has been served least, so one session's backlog does
+    not hold up the tenant's other sessions.
+    Requests whose expected wait exceeds their deadline are rejected up front,
+    and queued requests are dropped once their deadline passes.
+    """
+
+    def __init__(self, min_interval: float = MIN_REQUEST_INTERVAL, weights: dict = None):
+        self.min_interval = min_interval
+        self.weights = weights or PRIORITY_WEIGHTS
+        self._cond = threading.Condition()
+        # (tenant, priority) -> {"tags": deque of reserved slot tags,
+        #                        "sessions": session -> deque of tickets,
+        #                        "session_tags": session -> last tag, "clock": float}
+        self._flows = {}
+        self._last_tag = {}      # (tenant, priority) -> last finish tag
+        self._virtual_time = 0.0
+        self._next_slot = 0.0
+        self._sequence = itertools.count()
+        self._stats = {p: {"admitted": 0, "rejected": 0, "expired": 0, "ewma_wait": 0.0, "max_wait": 0.0}
+                       for p in self.weights}
+
+    def _queued(self) -> list:
+        return [ticket for flow in self._flows.values()
+                for queue in flow["sessions"].values() for ticket in queue]
+
+    def _head(self):
+        """The ticket that gets the next start slot"""
+        if not self._flows:
+            return None
+        flow = min(self._flows.values(), key=lambda f: f["tags"][0])
+        heads = [queue[0] for queue in flow["sessions"].values() if queue]
+        return min(heads, key=lambda t: (t["session_tag"], t["seq"]))
+
+    def _expected_wait(self, tag: float, now: float) -> float:
+        ahead = sum(1 for flow in self._flows.values() for slot in flow["tags"] if slot <= tag)
+        return max(self._next_slot - now, 0) + ahead * self.min_interval
+
+    def _remove(self, ticket: dict, dispatched: bool) -> float:
+        """
+        Take a ticket out of its flow together with one of the flow's slots: the
+        earliest when it is dispatched, the latest when it gives up. Returns the
+        slot's tag.
+        """
+        flow = self._flows[ticket["flow"]]
+        queue = flow["sessions"][ticket["session"]]
+        queue.remove(ticket)
+        if not queue:
+            del flow["sessions"][ticket["session"]]
+        tag = flow["tags"].popleft() if dispatched else flow["tags"].pop()
+        if dispatched:
+            flow["clock"] = ticket["session_tag"]
+        if not flow["tags"]:
+            del self._flows[ticket["flow"]]
+        return tag
+
+    def acquire(self, tenant: str, priority: str = "interactive", deadline: float = None,
+                session: str = None) -> float:
+        """Block until the request may call the model; returns the time spent queued"""
+        if priority not in self.weights:
+            raise ValueError(f"Priority must be one of: {', '.join(self.weights)}")
+        if deadline is None:
+            deadline = DEFAULT_DEADLINES.get(priority, 60)
+        session = session or tenant
+
+        with self._cond:
+            now = time.time()
+            key = (tenant, priority)
+            tag = max(self._virtual_time, self._last_tag.get(key, 0.0)) + 1.0 / self.weights[priority]
+            stats = self._stats[priority]
+
+            expected = self._expected_wait(tag, now)
+            if expected > deadline:
+                stats["rejected"] += 1
+                raise SchedulerRejected(
+                    f"Server busy: expected wait {expected:.0f}s exceeds deadline {deadline:.0f}s",
+                    expected
+                )
+
+            flow = self._flows.setdefault(key, {"tags": deque(), "sessions": {}, "session_tags": {}, "clock": 0.0})
+            session_tag = max(flow["clock"], flow["session_tags"].get(session, 0.0)) + 1.0
+            flow["session_tags"][session] = session_tag
+            ticket = {"flow": key, "session": session, "tag": tag, "session_tag": session_tag,
+                      "seq": next(self._sequence), "enqueued": now}
+            self._last_tag[key] = tag
+            flow["tags"].append(tag)
+            flow["sessions"].setdefault(session, deque()).append(ticket)
+            stats["admitted"] += 1
+
+            while True:
+                now = time.time()
+                if self._head() is ticket and now >= self._next_slot:
+                    break
+                if now - ticket["enqueued"] > deadline:
+                    self._remove(ticket, dispatched=False)
+                    stats["expired"] += 1
+                    self._cond.notify_all()
+                    raise SchedulerRejected(
+                        f"Request expired after waiting {now - ticket['enqueued']:.0f}s in the queue",
+                        self._expected_wait(tag, now)
+                    )
+                wake_at = min(max(self._next_slot, now + 0.05), ticket["enqueued"] + deadline)
+                self._cond.wait(timeout=max(wake_at - now, 0.05))
+
+            slot = self._remove(ticket, dispatched=True)
+            self._virtual_time = slot
+            self._next_slot = now + self.min_interval
+            # Idle flows whose tags the virtual clock has passed no longer matter
+            self._last_tag = {f: t for f, t in self._last_tag.items()
+                              if t > slot or f in self._flows}
+
+            waited = now - ticket["enqueued"]
+            stats["ewma_wait"] = 0.8 * stats["ewma_wait"] + 0.2 * waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+            self._cond.notify_all()
+            return waited
+
+    def stats(self) -> dict:
+        """Queue depth, per-class wait times and the wait a new request would face"""
+        with self._cond:
+            now = time.time()
+            queued = self._queued()
+            by_priority = {}
+            for priority, weight in self.weights.items():
+                waiting = [t for t in queued if t["flow"][1] == priority]
+                tag = self._virtual_time + 1.0 / weight
+                by_priority[priority] = {
+                    **{k: round(v, 2) for k, v in self._stats[priority].items()},
+                    "queue_depth": len(waiting),
+                    "oldest_wait": round(max((now - t["enqueued"] for t in waiting), default=0.0), 2),
+                    "expected_wait": round(self._expected_wait(tag, now), 2)
+                }
+            return {
+                "queue_depth": len(queued),
+                "tenants": len({t["flow"][0] for t in queued}),
+                "sessions": len({(t["flow"][0], t["session"]) for t in queued}),
+                "min_interval": self.min_interval,
+                "priorities": by_priority
+            }
+
+scheduler = GenerationScheduler()
+
+def scheduled(func):
+    """
+    Decorator routing model calls through the scheduler.
+    Accepts tenant, session, priority and deadline keyword arguments in
+    addition to the wrapped function's own; the time spent queued is added to
+    the result.
+    """
+    def wrapper(*args, tenant: str = "default", session: str = None,
+                priority: str = "interactive", deadline: float = None, **kwargs):
+        waited = scheduler.acquire(tenant, priority, deadline, session=session)
+        result = func(*args, **kwargs)
+        result["queue_wait"] = round(waited, 2)
+        return result
     return wrapper
 
-@rate_limit_decorator
-def get_gemini_response(user_message: str) -> dict:
+@scheduled
+def get_gemini_response(user_message: str, context: str = "", system_prompt: str = None) -> dict:
     """
     Calls Gemini AI with a structured prompt and returns the parsed response.
     Implements rate limiting and fallback model strategy.
+    An optional session context (see build_session_context) turns the request
+    into a follow-up edit of the session's current course; system_prompt replaces
+    the full-course prompt for narrower tasks such as regenerating one module.
     """
     SYSTEM_PROMPT = '''You are an expert educational designer and course creator with deep expertise in curriculum development, instructional design, and modern teaching methodologies. 
 
@@ -128,6 +297,8 @@ Format the response in a clear, structured manner suitable for:
 - PowerPoint generation
 - PDF creation
 - Lab instruction sheets'''
+    if system_prompt:
+        SYSTEM_PROMPT = system_prompt
     
     # List of models to try (from most preferred to fallback)
     # Using the most powerful and latest models for best course generation
@@ -156,6 +327,11 @@ Format the response in a clear, structured manner suitable for:
                 
                 # Create the full prompt
                 full_prompt = f"{SYSTEM_PROMPT}\n\nUser Request: {user_message}"
+                if context:
+                    full_prompt = (
+                        f"{SYSTEM_PROMPT}\n\n{FOLLOW_UP_INSTRUCTIONS}\n\n"
+                        f"Conversation Context:\n{context}\n\nUser Request: {user_message}"
+                    )
                 
                 # Generate response with retry logic
                 response = model.generate_content(
@@ -199,12 +375,570 @@ Format the response in a clear, structured manner suitable for:
         logger.error(f"Gemini AI error: {e}")
         return {"success": False, "error": f"AI service error: {str(e)}"}
 
+# Session history
+
+# Approximate prompt budget for the conversation context sent with follow-ups
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+RECENT_TURNS = 4  # Turns quoted verbatim; older ones are summarized
+SUMMARY_CHARS = 120
+MIN_TRUNCATED_TURN_TOKENS = 16  # Smaller leftovers are not worth a cut-down turn
+HISTORY_PAGE_SIZE = 20
+MAX_SESSIONS = 1000  # Least recently used sessions are evicted beyond this
+MAX_TURNS_PER_SESSION = 50
+MAX_HISTORY_PAGE_SIZE = 100
+
+FOLLOW_UP_INSTRUCTIONS = (
+    "This is a follow-up in an ongoing session. Apply the user's request to the "
+    "current course given in the conversation context. Return only the sections "
+    "you change or add, each starting with its heading line exactly as in the "
+    "outline (new modules get a new 'Module N' heading), with their full updated "
+    "content. Do not repeat unchanged sections."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (about 4 characters per token)"""
+    return (len(text) + 3) // 4
+
+def course_title(course_content: str) -> str:
+    """Best-effort title of a generated course: its first heading or first line"""
+    for section in parse_course_content(course_content):
+        if section["title"]:
+            return section["title"]
+    for line in course_content.split('\n'):
+        if line.strip():
+            return line.strip()[:SUMMARY_CHARS]
+    return "Untitled course"
+
+class CourseConflict(Exception):
+    """Raised when a session's course changed under an edit that depends on it"""
+
+class SessionStore:
+    """
+    Thread-safe in-memory store of chat turns and the current course per session.
+    Only the most recent turns of a session are kept, and the least recently
+    used sessions are evicted once there are more than max_sessions.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_turns: int = MAX_TURNS_PER_SESSION):
+        self._sessions = OrderedDict()
+        self._max_sessions = max_sessions
+        self._max_turns = max_turns
+        self._lock = threading.Lock()
+
+    def _session(self, session_id: str) -> dict:
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = {
+                "turns": [], "next_index": 0, "course": None, "course_id": None, "module_hashes": {}
+            }
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def add_turn(self, session_id: str, role: str, content: str, **extra) -> dict:
+        """
+        Append a turn; an assistant turn also becomes the session's current course
+        and its per-module content hashes are recorded. Pass course_id with an
+        assistant turn to start a new course; otherwise the current id is kept,
+        or a new one is created if the session has none yet.
+        """
+        hashes = module_hashes(content) if role == "assistant" else None
+        with self._lock:
+            return self._append(self._session(session_id), role, content, hashes, **extra)
+
+    def update_course(self, session_id: str, update, user_content: str, **extra) -> str:
+        """
+        Atomically replace the session's course with update(current course) and
+        record the user turn and the resulting assistant turn. The update runs
+        under the store lock against the latest course, so concurrent edits are
+        never lost; it may raise (e.g. CourseConflict) to abort without changes.
+        """
+        with self._lock:
+            session = self._session(session_id)
+            new_course = update(session["course"])
+            self._append(session, "user", user_content)
+            self._append(session, "assistant", new_course, module_hashes(new_course), **extra)
+        return new_course
+
+    def _append(self, session: dict, role: str, content: str, hashes: dict = None, **extra) -> dict:
+        """Append a turn to a session; the caller holds the lock"""
+        turn = {
+            "role": role,
+            "content": content,
+            "timestamp": datetime.now().isoformat(),
+            **extra
+        }
+        turn["index"] = session["next_index"]
+        session["next_index"] += 1
+        session["turns"].append(turn)
+        del session["turns"][:-self._max_turns]
+        if role == "assistant":
+            session["course"] = content
+            session["course_id"] = extra.get("course_id") or session["course_id"] or uuid.uuid4().hex
+            session["module_hashes"] = hashes
+        return turn
+
+    def get_turns(self, session_id: str) -> list:
+        with self._lock:
+            return list(self._sessions.get(session_id, {}).get("turns", []))
+
+    def get_course(self, session_id: str):
+        with self._lock:
+            return self._sessions.get(session_id, {}).get("course")
+
+    def get_course_id(self, session_id: str):
+        with self._lock:
+            return self._sessions.get(session_id, {}).get("course_id")
+
+    def get_module_hashes(self, session_id: str) -> dict:
+        with self._lock:
+            return dict(self._sessions.get(session_id, {}).get("module_hashes", {}))
+
+    def get_page(self, session_id: str, page: int, per_page: int) -> tuple:
+        """
+        Return (turns, total) for a page of history. Page 1 holds the most recent
+        turns; turns within a page are in chronological order.
+        """
+        with self._lock:
+            turns = self._sessions.get(session_id, {}).get("turns", [])
+            total = len(turns)
+            end = max(total - (page - 1) * per_page, 0)
+            start = max(end - per_page, 0)
+            return list(turns[start:end]), total
+
+session_store = SessionStore()
+
+def _describe_turn(turn: dict, limit: int = None) -> str:
+    """One-line rendering of a turn; assistant turns are referenced by course title"""
+    if turn["role"] == "assistant":
+        return f"Assistant: [generated course: {course_title(turn['content'])}]"
+    text = ' '.join(turn["content"].split())
+    if limit and len(text) > limit:
+        text = text[:limit].rstrip() + "..."
+    return f"User: {text}"
+
+def _referenced_units(course_content: str, user_message: str) -> list:
+    """Module units of the course whose number is mentioned in the message"""
+    keys = {f"module-{n}" for n in re.findall(r'\bmodule\s+(\d+)\b', user_message, re.IGNORECASE)}
+    if not keys:
+        return []
+    return [unit for unit in split_course_units(course_content) if unit["key"] in keys]
+
+def _unit_text(unit: dict) -> str:
+    return '\n'.join(line for raw in unit["raw"] for line in raw).strip()
+
+def apply_course_update(course_content: str, reply: str) -> tuple:
+    """
+    Splice a follow-up reply into the stored course and return
+    (updated course, keys of the units the reply changed or added).
+    Units in the reply replace the course units with the same key and new
+    units are appended; text before the reply's first heading is commentary
+    and is dropped. A reply sharing no unit with the course but holding
+    several modules is a whole new course and replaces it.
+    """
+    reply_units = [unit for unit in split_course_units(_strip_code_fence(reply))
+                   if unit["key"] != "overview"]
+    if not reply_units:
+        return course_content, []
+
+    units = split_course_units(course_content)
+    by_key = {unit["key"]: index for index, unit in enumerate(units)}
+    modules = sum(1 for unit in reply_units if unit["key"].startswith("module-"))
+    if not any(unit["key"] in by_key for unit in reply_units) and modules > 1:
+        return join_course_units(reply_units), [unit["key"] for unit in reply_units]
+
+    for unit in reply_units:
+        if unit["key"] in by_key:
+            units[by_key[unit["key"]]] = unit
+        else:
+            units.append(unit)
+    return join_course_units(units), [unit["key"] for unit in reply_units]
+
+def build_session_context(session_id: str, user_message: str,
+                          budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Build the conversation context for a follow-up request within a token budget.
+    The course text the model is asked to edit is always sent in full: the
+    outline plus the text of the modules the message names ("module 3"), or
+    the whole course when it names none. The rest of the budget goes to the
+    most recent turns (newest first, the one that no longer fits cut down to
+    the remaining budget), then a one-line summary per older turn, newest
+    first. Older turns are only summarized when every recent turn made it in.
+    Returns an empty string for a session with no history.
+    """
+    turns = session_store.get_turns(session_id)
+    course = session_store.get_course(session_id)
+    if not turns:
+        return ""
+
+    parts = []
+    remaining = budget
+
+    def add(text: str) -> bool:
+        nonlocal remaining
+        cost = estimate_tokens(text)
+        if cost > remaining:
+            return False
+        parts.append(text)
+        remaining -= cost
+        return True
+
+    if course:
+        outline = [f"- {s['title']}" for s in parse_course_content(course) if s["title"]]
+        course_part = f"Current course: {course_title(course)}\nOutline:\n" + '\n'.join(outline)
+        referenced = _referenced_units(course, user_message)
+        if referenced:
+            for unit in referenced:
+                course_part += f"\n\nCurrent text of {unit['title']}:\n{_unit_text(unit)}"
+        else:
+            course_part += f"\n\nCurrent course text:\n{course}"
+        parts.append(course_part)
+        remaining -= estimate_tokens(course_part)
+
+    recent, older = turns[-RECENT_TURNS:], turns[:-RECENT_TURNS]
+    header = "Recent conversation:\n"
+    room = remaining - estimate_tokens(header)
+    recent_lines = []
+    for turn in reversed(recent):
+        line = _describe_turn(turn)
+        if estimate_tokens(line) + 1 > room:
+            # Keep as much of the turn as still fits, if that is a useful amount
+            line = _describe_turn(turn, max((room - 2) * 4 - len("Assistant: ..."), 0))
+            if room < MIN_TRUNCATED_TURN_TOKENS or estimate_tokens(line) + 1 > room:
+                break
+        recent_lines.append(line)
+        room -= estimate_tokens(line) + 1
+    all_recent = len(recent_lines) == len(recent)
+    if recent_lines:
+        add(header + '\n'.join(reversed(recent_lines)))
+
+    summary = []
+    for turn in (reversed(older) if all_recent else []):
+        line = f"- {_describe_turn(turn, SUMMARY_CHARS)}"
+        if estimate_tokens(line) > remaining:
+            break
+        summary.append(line)
+        remaining -= estimate_tokens(line)
+    if summary:
+        parts.insert(1 if course else 0, "Earlier in this session:\n" + '\n'.join(reversed(summary)))
+
+    return '\n\n'.join(parts)
+
+# Search index
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index.db")
+SEARCH_PAGE_SIZE = 10
+MAX_SEARCH_PAGE_SIZE = 50
+
+class SearchIndex:
+    """
+    SQLite FTS5 full-text index over generated courses, one row per course unit
+    (see split_course_units) with the course title, module title, topics and lab
+    activities as separate columns. Each course has its own id, and re-indexing
+    a course only rewrites the units whose content changed. Searches return one
+    result per course, represented by its best matching unit; the course itself
+    is fetched by id with get_course. Session ids are never stored here, since
+    they are what grants access to a session.
+    """
+
+    SCHEMA_VERSION = 3
+    # Snippet markers that cannot occur in indexed text; swapped for <mark> after escaping
+    MARK_START, MARK_END = '\x02', '\x03'
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.available = True
+        try:
+            with self._connect() as conn:
+                # The index only holds derived data, so older layouts are rebuilt
+                if conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                    conn.executescript('''
+                        DROP TABLE IF EXISTS courses;
+                        DROP TABLE IF EXISTS course_units;
+                        DROP TABLE IF EXISTS course_search;
+                    ''')
+                conn.executescript(f'''
+                    CREATE TABLE IF NOT EXISTS courses (
+                        course_id TEXT PRIMARY KEY,
+                        title TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        updated_at TEXT NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS course_units (
+                        course_id TEXT NOT NULL,
+                        unit_key TEXT NOT NULL,
+                        hash TEXT NOT NULL,
+                        search_rowid INTEGER NOT NULL,
+                        PRIMARY KEY (course_id, unit_key)
+                    );
+                    CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5(
+                        course_id UNINDEXED, unit_key UNINDEXED,
+                        course_title, module, topics, labs,
+                        tokenize = 'porter unicode61'
+                    );
+                    PRAGMA user_version = {self.SCHEMA_VERSION};
+                ''')
+        except sqlite3.OperationalError as e:
+            self.available = False
+            logger.warning(f"Search index disabled ({e})")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _unit_fields(unit: dict) -> tuple:
+        """(topics, labs) text of a unit: lab activities apart from everything else"""
+        labs = extract_lab_activities(unit["sections"])
+        lab_lines = {line for lab in labs for line in lab["lines"]}
+        lab_text = '\n'.join(f"{lab['title']}: " + ' '.join(lab["lines"]) for lab in labs)
+
+        topics = [section["title"] for section in unit["sections"][1:] if section["title"]]
+        for section in unit["sections"]:
+            topics.extend(line for line in section["lines"] if line and line not in lab_lines)
+        return '\n'.join(topics), lab_text
+
+    def index_course(self, course_id: str, course_content: str) -> int:
+        """Add or update a course, returning how many units were (re)written"""
+        if not course_id:
+            raise ValueError("A course_id is required to index a course")
+        if not self.available:
+            return 0
+
+        title = course_title(course_content)
+        units = split_course_units(course_content)
+        # The course title is stored on every row so that a query can match the
+        # title and a module together; a new title therefore changes every unit
+        hashes = {
+            unit["key"]: hashlib.sha256(f"{title}\n{unit['hash']}".encode('utf-8')).hexdigest()[:16]
+            for unit in units
+        }
+
+        with self._lock, self._connect() as conn:
+            existing = {
+                key: (unit_hash, rowid) for key, unit_hash, rowid in conn.execute(
+                    "SELECT unit_key, hash, search_rowid FROM course_units WHERE course_id = ?",
+                    (course_id,)
+                )
+            }
+
+            for key, (_, rowid) in existing.items():
+                if key not in hashes:
+                    conn.execute("DELETE FROM course_search WHERE rowid = ?", (rowid,))
+                    conn.execute("DELETE FROM course_units WHERE course_id = ? AND unit_key = ?",
+                                 (course_id, key))
+
+            written = 0
+            for unit in units:
+                key = unit["key"]
+                previous = existing.get(key)
+                if previous and previous[0] == hashes[key]:
+                    continue
+                if previous:
+                    conn.execute("DELETE FROM course_search WHERE rowid = ?", (previous[1],))
+
+                topics, labs = self._unit_fields(unit)
+                cursor = conn.execute(
+                    "INSERT INTO course_search (course_id, unit_key, course_title, module, topics, labs) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (course_id, key, title, unit["title"] or "", topics, labs)
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO course_units (course_id, unit_key, hash, search_rowid) "
+                    "VALUES (?, ?, ?, ?)",
+                    (course_id, key, hashes[key], cursor.lastrowid)
+                )
+                written += 1
+
+            conn.execute(
+                "INSERT OR REPLACE INTO courses (course_id, title, content, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (course_id, title, course_content, datetime.now().isoformat())
+            )
+
+        return written
+
+    def get_course(self, course_id: str):
+        """An indexed course with its content and module list, or None"""
+        if not self.available:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT title, content, updated_at FROM courses WHERE course_id = ?", (course_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        title, content, updated_at = row
+        return {
+            "course_id": course_id,
+            "course_title": title,
+            "course_content": content,
+            "modules": [{"key": unit["key"], "title": unit["title"]}
+                        for unit in split_course_units(content)],
+            "updated_at": updated_at
+        }
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """Quote each word so user input can't break FTS5 syntax; the last word is a prefix"""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return ""
+        terms = [f'"{word}"' for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    @classmethod
+    def _render_snippet(cls, snippet: str) -> str:
+        """HTML-escape model text, then turn the match markers into <mark> tags"""
+        escaped = html.escape(snippet or "")
+        return escaped.replace(cls.MARK_START, '<mark>').replace(cls.MARK_END, '</mark>')
+
+    def search(self, query: str, page: int = 1, per_page: int = SEARCH_PAGE_SIZE) -> tuple:
+        """
+        Return (results, total) for a query with one result per course, best first.
+        A course is ranked by its best matching unit, where matches in titles and
+        module names weigh more than labs, which weigh more than other topics.
+        Snippets are HTML-escaped with matches wrapped in <mark> tags.
+        """
+        match = self._match_expression(query)
+        if not self.available or not match:
+            return [], 0
+
+        with self._connect() as conn:
+            total = conn.execute(
+                "SELECT count(DISTINCT course_id) FROM course_search WHERE course_search MATCH ?",
+                (match,)
+            ).fetchone()[0]
+            rows = conn.execute(
+                '''
+                SELECT h.course_id, h.unit_key, h.module, c.title, c.updated_at,
+                       h.score, h.snippet, h.matched_units
+                FROM (
+                    SELECT *,
+                           ROW_NUMBER() OVER (PARTITION BY course_id ORDER BY score) AS unit_rank,
+                           COUNT(*) OVER (PARTITION BY course_id) AS matched_units
+                    FROM (
+                        SELECT course_id, unit_key, module,
+                               bm25(course_search, 0.0, 0.0, 5.0, 3.0, 1.0, 2.0) AS score,
+                               snippet(course_search, -1, ?, ?, '...', 16) AS snippet
+                        FROM course_search
+                        WHERE course_search MATCH ?
+                    )
+                ) AS h
+                JOIN courses AS c ON c.course_id = h.course_id
+                WHERE h.unit_rank = 1
+                ORDER BY h.score, c.updated_at DESC
+                LIMIT ? OFFSET ?
+                ''',
+                (self.MARK_START, self.MARK_END, match, per_page, (page - 1) * per_page)
+            ).fetchall()
+
+        results = [{
+            "course_id": course_id,
+            "course_title": title,
+            "module_key": unit_key,
+            "module": module or None,
+            "snippet": self._render_snippet(snippet),
+            "matched_units": matched_units,
+            "score": round(-score, 4),
+            "updated_at": updated_at
+        } for (course_id, unit_key, module, title, updated_at,
+               score, snippet, matched_units) in rows]
+        return results, total
+
+    def backfill_decks(self, folder: str = UPLOAD_FOLDER) -> int:
+        """
+        One-off indexing of courses generated before the index existed, rebuilt
+        from the PowerPoint decks in the files folder. Decks are keyed by file
+        name, so running this again only rewrites decks that changed.
+        Returns the number of decks indexed.
+        """
+        indexed = 0
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith('.pptx'):
+                continue
+            try:
+                course_content = course_from_deck(os.path.join(folder, filename))
+                if course_content.strip():
+                    self.index_course(f"file:{filename}", course_content)
+                    indexed += 1
+            except Exception as e:
+                logger.warning(f"Could not index {filename}: {e}")
+        return indexed
+
+def course_from_deck(path: str) -> str:
+    """Rebuild course text from a deck made by render_powerpoint (one heading per slide)"""
+    prs = Presentation(path)
+    lines = []
+    for slide in list(prs.slides)[1:]:  # Skip the generic title slide
+        title = slide.shapes.title
+        if title is not None:
+            lines.append(f"## {title.text}")
+        for shape in slide.shapes:
+            if shape.has_text_frame and (title is None or shape.shape_id != title.shape_id):
+                lines.extend(shape.text_frame.text.split('\n'))
+    return '\n'.join(lines)
+
+search_index = SearchIndex()
+
 # Flask routes
 
 @app.route('/')
 def home():
     return jsonify({"message": "AI Course Generator API is running", "status": "active"})
 
+def _scheduling_options(data: dict) -> dict:
+    """
+    Scheduler arguments from a request body. The tenant is the tenant_id, else
+    the client address, so a client cannot claim extra shares by inventing
+    session ids; the session_id only picks the sub-queue within the tenant.
+    """
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITY_WEIGHTS:
+        raise ValueError(f"Priority must be one of: {', '.join(PRIORITY_WEIGHTS)}")
+
+    deadline = data.get('deadline')
+    if deadline is not None:
+        try:
+            deadline = float(deadline)
+        except (TypeError, ValueError):
+            deadline = 0
+        if deadline <= 0:
+            raise ValueError("Deadline must be a positive number of seconds")
+
+    tenant = str(data.get('tenant_id') or f"client:{request.remote_addr}")
+    session = str(data.get('session_id') or tenant)
+    return {"tenant": tenant, "session": session, "priority": priority, "deadline": deadline}
+
+def _rejected_response(error: SchedulerRejected):
+    """429 response for a request the scheduler could not fit before its deadline"""
+    retry_after = int(error.expected_wait) + 1
+    response = jsonify({
+        "success": False,
+        "error": str(error),
+        "expected_wait": round(error.expected_wait, 1),
+        "suggestion": f"Retry in about {retry_after} seconds or use a longer deadline."
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def _index_course(session_id: str) -> None:
+    """Update the search index for a session's current course without failing the request"""
+    try:
+        course_id = session_store.get_course_id(session_id)
+        written = search_index.index_course(course_id, session_store.get_course(session_id))
+        logger.info(f"Session {session_id}: indexed {written} changed units of course {course_id}")
+    except Exception as e:
+        logger.error(f"Search indexing error: {e}")
+
+@app.route('/queue')
+def queue_status():
+    return jsonify({"success": True, **scheduler.stats()})
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
@@ -213,15 +947,58 @@ def chat():
             return jsonify({"success": False, "error": "Message is required"}), 400
         
         user_message = data['message']
-        session_id = data.get('session_id', 'default')
+        try:
+            options = _scheduling_options(data)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        
+        # Without a session_id this is a new course in a new private session,
+        # whose id is returned so the client can send follow-ups
+        session_id = data.get('session_id')
+        is_follow_up = bool(session_id)
+        if not is_follow_up:
+            session_id = uuid.uuid4().hex
+        
+        # new_course starts a separate course within an existing session
+        new_course = not is_follow_up or bool(data.get('new_course'))
         
-        # Get response from Gemini AI
-        result = get_gemini_response(user_message)
+        # Follow-ups carry a budgeted view of the session instead of the full history
+        context = "" if new_course else build_session_context(session_id, user_message)
+        
+        # Get response from Gemini AI, queued fairly behind other sessions' requests
+        try:
+            result = get_gemini_response(user_message, context=context, **options)
+        except SchedulerRejected as e:
+            return _rejected_response(e)
         
         # Log the interaction
         logger.info(f"Session {session_id}: User asked about '{user_message[:50]}...'")
         
         if result["success"]:
+            if context:
+                # Follow-up replies hold only the changed sections; splice them into
+                # the latest version of the course so concurrent edits are kept
+                updated = []
+
+                def merge(current: str) -> str:
+                    if not current:
+                        return result["response"]
+                    course, keys = apply_course_update(current, result["response"])
+                    updated.extend(keys)
+                    return course
+
+                result["response"] = session_store.update_course(
+                    session_id, merge, user_message, model_used=result.get("model_used"))
+                result["updated_modules"] = updated
+            else:
+                session_store.add_turn(session_id, "user", user_message)
+                session_store.add_turn(session_id, "assistant", result["response"],
+                                       model_used=result.get("model_used"),
+                                       **({"course_id": uuid.uuid4().hex} if new_course else {}))
+            _index_course(session_id)
+            result["session_id"] = session_id
+            result["course_id"] = session_store.get_course_id(session_id)
+            result["context_tokens"] = estimate_tokens(context)
             return jsonify(result)
         else:
             return jsonify(result), 500
@@ -230,135 +1007,731 @@ def chat():
         logger.error(f"Chat endpoint error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
-def create_powerpoint(course_content: str, filename: str) -> bool:
-    """Create a PowerPoint presentation from course content"""
+@app.route('/history')
+def history():
     try:
-        prs = Presentation()
-        
-        # Title slide
-        title_slide_layout = prs.slide_layouts[0]
-        slide = prs.slides.add_slide(title_slide_layout)
-        title = slide.shapes.title
-        subtitle = slide.placeholders[1]
-        
-        title.text = "AI Generated Course"
-        subtitle.text = "Comprehensive Learning Program"
-        
-        # Content slides - split content by lines and create slides
-        lines = course_content.split('\n')
-        current_slide = None
-        current_content = []
-        
-        for line in lines:
-            line = line.strip()
+        session_id = request.args.get('session_id')
+        if not session_id:
+            return jsonify({"success": False, "error": "session_id is required"}), 400
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', HISTORY_PAGE_SIZE, type=int)
+        if page < 1 or per_page < 1:
+            return jsonify({"success": False, "error": "page and per_page must be positive"}), 400
+        per_page = min(per_page, MAX_HISTORY_PAGE_SIZE)
+
+        turns, total = session_store.get_page(session_id, page, per_page)
+        return jsonify({
+            "success": True,
+            "session_id": session_id,
+            "turns": turns,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "has_more": page * per_page < total
+        })
+    except Exception as e:
+        logger.error(f"History endpoint error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/search')
+def search():
+    try:
+        query = request.args.get('q', '').strip()
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', SEARCH_PAGE_SIZE, type=int)
+        if not query:
+            return jsonify({"success": False, "error": "Query parameter q is required"}), 400
+        if page < 1 or per_page < 1:
+            return jsonify({"success": False, "error": "page and per_page must be positive"}), 400
+        if not search_index.available:
+            return jsonify({"success": False, "error": "Search index is not available"}), 503
+        per_page = min(per_page, MAX_SEARCH_PAGE_SIZE)
+
+        results, total = search_index.search(query, page, per_page)
+        return jsonify({
+            "success": True,
+            "query": query,
+            "results": results,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "has_more": page * per_page < total
+        })
+    except Exception as e:
+        logger.error(f"Search endpoint error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+REGENERATE_PROMPT = (
+    "You are an expert educational designer revising one part of an existing course. "
+    "Rewrite only the part given below according to the instructions, keeping its "
+    "heading lines and Markdown structure so it fits back into the course. "
+    "Return only the revised part, with no commentary before or after it."
+)
+REGENERATE_PARTS = ('module', 'slide', 'lab')
+
+def _strip_code_fence(text: str) -> str:
+    """Remove a Markdown code fence wrapped around a whole model response"""
+    lines = text.strip().split('\n')
+    if len(lines) >= 2 and lines[0].startswith('```') and lines[-1].strip() == '```':
+        lines = lines[1:-1]
+    return '\n'.join(lines)
+
+def _positive_int(value, name: str) -> int:
+    """Parse a positive integer request field (number or digit string), raising ValueError otherwise"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        number = value
+    elif isinstance(value, str) and value.strip().isdigit():
+        number = int(value)
+    else:
+        number = 0
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return number
+
+def _part_index(unit: dict, part: str, slide: int = None):
+    """
+    Index into unit["raw"] of the section to regenerate, or None for the whole
+    module. Slides are numbered from 1 (the module's own slide); a lab is the
+    first section whose heading or a labelled line mentions lab work.
+    """
+    if part == 'module':
+        return None
+    if part == 'slide':
+        if not slide or not 1 <= slide <= len(unit["sections"]):
+            raise ValueError(f"Slide must be between 1 and {len(unit['sections'])}")
+        return slide - 1
+    for index, section in enumerate(unit["sections"]):
+        if LAB_PATTERN.search(section["title"] or ''):
+            return index
+        for line in section["lines"]:
+            if line.strip('*').rstrip().endswith(':') and LAB_PATTERN.search(line):
+                return index
+    raise ValueError("This module has no lab activities")
+
+@app.route('/course/<course_id>')
+def get_course(course_id):
+    try:
+        if not search_index.available:
+            return jsonify({"success": False, "error": "Search index is not available"}), 503
+        course = search_index.get_course(course_id)
+        if course is None:
+            return jsonify({"success": False, "error": "Course not found"}), 404
+        return jsonify({"success": True, **course})
+    except Exception as e:
+        logger.error(f"Course endpoint error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/regenerate_module', methods=['POST'])
+def regenerate_module():
+    try:
+        data = request.get_json()
+        if not data or 'module' not in data:
+            return jsonify({"success": False, "error": "Module number is required"}), 400
+
+        session_id = data.get('session_id')
+        if not session_id:
+            return jsonify({"success": False, "error": "session_id is required"}), 400
+        part = data.get('part', 'module')
+        instructions = data.get('instructions') or "Improve and expand this content."
+        if part not in REGENERATE_PARTS:
+            return jsonify({"success": False, "error": f"Part must be one of: {', '.join(REGENERATE_PARTS)}"}), 400
+        try:
+            options = _scheduling_options(data)
+            module = _positive_int(data['module'], "Module")
+            slide = _positive_int(data['slide'], "Slide") if part == 'slide' and 'slide' in data else None
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        course = session_store.get_course(session_id)
+        if not course:
+            return jsonify({"success": False, "error": "No course stored for this session"}), 404
+
+        units = split_course_units(course)
+        key = f"module-{module}"
+        unit = next((u for u in units if u["key"] == key), None)
+        if unit is None:
+            return jsonify({"success": False, "error": f"Module {module} not found in course"}), 404
+
+        try:
+            index = _part_index(unit, part, slide)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        raw = unit["raw"] if index is None else [unit["raw"][index]]
+        current_text = '\n'.join(line for lines in raw for line in lines).strip()
+        label = unit["title"] if index is None else f"{unit['title']} / {unit['sections'][index]['title']}"
+        outline = '\n'.join(f"- {u['title']}" for u in units if u["title"])
+        prompt = (
+            f"Course: {course_title(course)}\nOutline:\n{outline}\n\n"
+            f"Part to revise ({label}):\n{current_text}\n\nInstructions: {instructions}"
+        )
+
+        try:
+            result = get_gemini_response(prompt, system_prompt=REGENERATE_PROMPT, **options)
+        except SchedulerRejected as e:
+            return _rejected_response(e)
+        if not result["success"]:
+            return jsonify(result), 500
+
+        new_lines = _strip_code_fence(result["response"]).split('\n')
+        base_hash = unit["hash"]
+        previous_hashes = {}
+
+        def splice(current: str) -> str:
+            # Splice into the latest course, leaving every other unit untouched; only
+            # a change to this module during the model call counts as a conflict
+            current_units = split_course_units(current or "")
+            target = next((u for u in current_units if u["key"] == key), None)
+            if target is None or target["hash"] != base_hash:
+                raise CourseConflict(f"Module {module} changed while it was being regenerated")
+            previous_hashes.update((u["key"], u["hash"]) for u in current_units)
+            if index is None:
+                target["raw"] = [new_lines]
+            else:
+                target["raw"][index] = new_lines
+            return join_course_units(current_units)
+
+        try:
+            new_course = session_store.update_course(
+                session_id, splice, f"Regenerate {label}: {instructions}",
+                model_used=result.get("model_used"), regenerated=key
+            )
+        except CourseConflict as e:
+            return jsonify({"success": False, "error": str(e)}), 409
+        _index_course(session_id)
+        hashes = module_hashes(new_course)
+
+        logger.info(f"Session {session_id}: regenerated {label}")
+        return jsonify({
+            "success": True,
+            "response": new_course,
+            "model_used": result.get("model_used"),
+            "queue_wait": result.get("queue_wait"),
+            "session_id": session_id,
+            "course_id": session_store.get_course_id(session_id),
+            "module": key,
+            "module_hashes": hashes,
+            "changed_modules": [k for k, h in hashes.items() if previous_hashes.get(k) != h]
+        })
+
+    except Exception as e:
+        logger.error(f"Module regeneration error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+HEADING_PREFIXES = ('MODULE', 'SECTION', 'CHAPTER')
+
+# Headings and "Label:" lines that introduce hands-on work for the lab sheet
+LAB_PATTERN = re.compile(r'\b(labs?|exercises?|hands-on|projects?)\b', re.IGNORECASE)
+
+# Formats available from /export: format -> file name inside the archive
+EXPORT_FORMATS = {
+    'pptx': 'course.pptx',
+    'pdf': 'course.pdf',
+    'lab_sheet': 'lab_sheet.pdf',
+}
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def is_heading(line: str) -> bool:
+    """Check if a stripped line starts a new module, section or chapter"""
+    return line.startswith('#') or line.upper().startswith(HEADING_PREFIXES)
+
+def parse_course_content(course_content: str) -> list:
+    """
+    Split course content into sections, one per heading line.
+    Each section is a dict with a 'title' (None for any text before the first
+    heading) and the stripped 'lines' under it, blank lines kept as ''.
+    """
+    return _parse_sections(course_content)[0]
+
+def _parse_sections(course_content: str) -> tuple:
+    """
+    Single pass behind parse_course_content that also returns the unstripped
+    lines of each section, so units can be spliced back losslessly.
+    """
+    sections = [{"title": None, "lines": []}]
+    chunks = [[]]
+    for raw_line in course_content.split('\n'):
+        line = raw_line.strip()
+        if line and is_heading(line):
+            sections.append({"title": line.replace('#', '').strip(), "lines": []})
+            chunks.append([raw_line])
+        else:
+            sections[-1]["lines"].append(line)
+            chunks[-1].append(raw_line)
+    return sections, chunks
+
+def extract_lab_activities(sections: list) -> list:
+    """Collect lab, exercise and project content from parsed course sections"""
+    labs = []
+    module_title = None
+
+    for section in sections:
+        title = section["title"]
+        if title is None:
+            continue
+        if _plain_title(title).upper().startswith('MODULE'):
+            module_title = title
+
+        # Whole section is a lab (e.g. "### Lab Activities")
+        if LAB_PATTERN.search(title):
+            lines = [line for line in section["lines"] if line]
+            if lines:
+                labs.append({"module": module_title, "title": title, "lines": lines})
+            continue
+
+        # Labelled block inside a section (e.g. "**Lab Activities:**" + bullets)
+        current = None
+        for line in section["lines"]:
             if not line:
-                continue
-                
-            # Check if this is a major heading (Module, Section, etc.)
-            if (line.startswith('#') or 
-                line.upper().startswith('MODULE') or 
-                line.upper().startswith('SECTION') or
-                line.upper().startswith('CHAPTER')):
-                
-                # Save previous slide if exists
-                if current_slide and current_content:
-                    content_text = '\n'.join(current_content)
-                    if len(current_slide.shapes) > 1:
-                        current_slide.shapes[1].text = content_text
-                
-                # Create new slide
-                bullet_slide_layout = prs.slide_layouts[1]
-                current_slide = prs.slides.add_slide(bullet_slide_layout)
-                title = current_slide.shapes.title
-                title.text = line.replace('#', '').strip()
-                current_content = []
-                
+                current = None
+            elif line.strip('*').rstrip().endswith(':'):
+                current = None
+                if LAB_PATTERN.search(line):
+                    current = {"module": module_title, "title": line.strip('*: '), "lines": []}
+                    labs.append(current)
+            elif current is not None:
+                current["lines"].append(line)
+
+    return [lab for lab in labs if lab["lines"]]
+
+def _plain_title(title: str) -> str:
+    """Heading title without surrounding Markdown emphasis (e.g. '**Module 1: Intro**')"""
+    return re.sub(r'^[*_\s]+|[*_\s]+$', '', title)
+
+def _slug(text: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'section'
+
+def split_course_units(course_content: str) -> list:
+    """
+    Group course sections into independently regenerated and rendered units.
+    The text before the first heading is the 'overview' unit, every module
+    heading starts a 'module-<n>' unit, and any other heading starts a unit of
+    its own; deeper headings (more '#') belong to the unit above them.
+    Each unit has a 'key', 'title', parsed 'sections', the matching 'raw'
+    line lists (so units can be spliced back losslessly) and a content 'hash'.
+    """
+    units = []
+    unit_level = None
+
+    for section, raw in zip(*_parse_sections(course_content)):
+        title = section["title"]
+        if title is None:
+            if raw:
+                units.append({"key": "overview", "title": None, "sections": [section], "raw": [raw]})
+            continue
+
+        stripped = raw[0].strip()
+        level = len(stripped) - len(stripped.lstrip('#'))
+        plain = _plain_title(title)
+        is_module = plain.upper().startswith('MODULE')
+
+        if not is_module and unit_level is not None and level > unit_level:
+            units[-1]["sections"].append(section)
+            units[-1]["raw"].append(raw)
+            continue
+
+        match = re.match(r'module\s+(\d+)', plain, re.IGNORECASE)
+        key = f"module-{match.group(1)}" if match else f"section-{_slug(plain)}"
+        units.append({"key": key, "title": title, "sections": [section], "raw": [raw]})
+        unit_level = level
+
+    seen = {}
+    for unit in units:
+        count = seen[unit["key"]] = seen.get(unit["key"], 0) + 1
+        if count > 1:
+            unit["key"] = f"{unit['key']}-{count}"
+        text = '\n'.join(line for raw in unit["raw"] for line in raw)
+        unit["hash"] = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+    return units
+
+def join_course_units(units: list) -> str:
+    """Inverse of split_course_units"""
+    return '\n'.join(line for unit in units for raw in unit["raw"] for line in raw)
+
+def module_hashes(course_content: str) -> dict:
+    """Content hash of every unit of a course, keyed by unit key"""
+    return {unit["key"]: unit["hash"] for unit in split_course_units(course_content)}
+
+def _new_presentation() -> Presentation:
+    """Start a deck with the course title slide"""
+    prs = Presentation()
+
+    # Title slide
+    title_slide_layout = prs.slide_layouts[0]
+    slide = prs.slides.add_slide(title_slide_layout)
+    title = slide.shapes.title
+    subtitle = slide.placeholders[1]
+
+    title.text = "AI Generated Course"
+    subtitle.text = "Comprehensive Learning Program"
+
+    return prs
+
+def _add_section_slide(prs: Presentation, section: dict) -> None:
+    """Append one bullet slide for a titled section"""
+    bullet_slide_layout = prs.slide_layouts[1]
+    current_slide = prs.slides.add_slide(bullet_slide_layout)
+    current_slide.shapes.title.text = section["title"]
+
+    current_content = [line for line in section["lines"] if line]
+    if current_content and len(current_slide.shapes) > 1:
+        current_slide.shapes[1].text = '\n'.join(current_content)
+
+def render_powerpoint(sections: list, output) -> None:
+    """Render parsed course sections as a PowerPoint deck to a path or file object"""
+    prs = _new_presentation()
+
+    # One bullet slide per heading
+    for section in sections:
+        if section["title"] is not None:
+            _add_section_slide(prs, section)
+
+    prs.save(output)
+
+def _pdf_styles() -> tuple:
+    """Build the title and heading styles shared by the PDF exports"""
+    styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=colors.darkblue
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceAfter=12,
+        textColor=colors.darkgreen
+    )
+
+    return styles, title_style, heading_style
+
+def _section_flowables(section: dict, styles, heading_style) -> list:
+    """PDF flowables for one parsed section: its heading, then a paragraph per line"""
+    flowables = []
+    if section["title"] is not None:
+        flowables.append(Paragraph(section["title"], heading_style))
+        flowables.append(Spacer(1, 6))
+
+    for line in section["lines"]:
+        if line:
+            flowables.append(Paragraph(line, styles['Normal']))
+        flowables.append(Spacer(1, 6))
+
+    return flowables
+
+def render_pdf(sections: list, output) -> None:
+    """Render parsed course sections as a PDF document to a path or file object"""
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles, title_style, heading_style = _pdf_styles()
+    story = []
+
+    # Add title
+    story.append(Paragraph("AI Generated Course Content", title_style))
+    story.append(Spacer(1, 20))
+
+    for section in sections:
+        story.extend(_section_flowables(section, styles, heading_style))
+
+    doc.build(story)
+
+def render_lab_sheet(sections: list, output) -> None:
+    """Render the lab activities of parsed course sections as a PDF lab sheet"""
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    styles, title_style, heading_style = _pdf_styles()
+    story = []
+
+    story.append(Paragraph("Lab Instruction Sheet", title_style))
+    story.append(Spacer(1, 20))
+
+    labs = extract_lab_activities(sections)
+    if not labs:
+        story.append(Paragraph("No lab activities were found in this course.", styles['Normal']))
+
+    for lab in labs:
+        heading = lab["title"]
+        if lab["module"] and lab["module"] != lab["title"]:
+            heading = f"{lab['module']} - {heading}"
+        story.append(Paragraph(heading, heading_style))
+
+        for line in lab["lines"]:
+            story.append(Paragraph(line, styles['Normal']))
+            story.append(Spacer(1, 6))
+        story.append(Spacer(1, 12))
+
+    doc.build(story)
+
+EXPORT_RENDERERS = {
+    'pptx': render_powerpoint,
+    'pdf': render_pdf,
+    'lab_sheet': render_lab_sheet,
+}
+
+class RenderCache:
+    """
+    Rendered fragments reused between exports so that only changed units re-render.
+    PDF flowables are cached per unit hash (shared by all sessions, LRU-bounded);
+    for PowerPoint the last deck of each session is kept and its slides for
+    unchanged units are carried over into the next deck. PDF page layout is
+    still redone on every export since page breaks depend on the whole story.
+    """
+
+    def __init__(self, max_fragments: int = 512, max_decks: int = 64):
+        self._fragments = OrderedDict()
+        self._decks = OrderedDict()
+        self._max_fragments = max_fragments
+        self._max_decks = max_decks
+        self._lock = threading.Lock()
+
+    def _remember(self, store: OrderedDict, key, value, limit: int) -> None:
+        with self._lock:
+            store[key] = value
+            store.move_to_end(key)
+            while len(store) > limit:
+                store.popitem(last=False)
+
+    def _recall(self, store: OrderedDict, key):
+        with self._lock:
+            value = store.get(key)
+            if value is not None:
+                store.move_to_end(key)
+            return value
+
+    def render_pdf(self, units: list, output) -> int:
+        """Render units as a PDF, returning how many units had to be re-rendered"""
+        doc = SimpleDocTemplate(output, pagesize=letter)
+        styles, title_style, heading_style = _pdf_styles()
+        story = [Paragraph("AI Generated Course Content", title_style), Spacer(1, 20)]
+        rendered = 0
+
+        for unit in units:
+            fragment = self._recall(self._fragments, unit["hash"])
+            if fragment is None:
+                fragment = [f for section in unit["sections"]
+                            for f in _section_flowables(section, styles, heading_style)]
+                self._remember(self._fragments, unit["hash"], fragment, self._max_fragments)
+                rendered += 1
+            # Layout state is stored on the flowables, so each build gets its own copies
+            story.extend(copy.copy(flowable) for flowable in fragment)
+
+        doc.build(story)
+        return rendered
+
+    def render_powerpoint(self, session_id: str, units: list, output) -> int:
+        """
+        Render units as a deck for a session, starting from the session's previous
+        deck and adding slides only for units whose hash is new. Returns how many
+        units had to be re-rendered.
+        """
+        previous = self._recall(self._decks, session_id)
+        if previous is None:
+            prs = _new_presentation()
+            reusable = {}
+        else:
+            prs = Presentation(io.BytesIO(previous["pptx"]))
+            reusable = {}
+            slide_ids = list(prs.slides._sldIdLst)
+            position = 1  # Title slide comes first
+            for unit_hash, count in previous["layout"]:
+                reusable.setdefault(unit_hash, []).append(slide_ids[position:position + count])
+                position += count
+
+        slide_id_list = prs.slides._sldIdLst
+        old_slide_ids = list(slide_id_list)
+        order = old_slide_ids[:1]
+        layout = []
+        rendered = 0
+
+        for unit in units:
+            groups = reusable.get(unit["hash"])
+            if groups:
+                group = groups.pop(0)
             else:
-                # Add to current slide content
-                current_content.append(line)
-        
-        # Don't forget the last slide
-        if current_slide and current_content:
-            content_text = '\n'.join(current_content)
-            if len(current_slide.shapes) > 1:
-                current_slide.shapes[1].text = content_text
-        
-        # Save presentation
+                before = len(slide_id_list)
+                for section in unit["sections"]:
+                    if section["title"] is not None:
+                        _add_section_slide(prs, section)
+                group = list(slide_id_list)[before:]
+                rendered += 1
+            order.extend(group)
+            layout.append((unit["hash"], len(group)))
+
+        # Put slides in course order, then drop slides of units that went away
+        for slide_id in list(slide_id_list):
+            slide_id_list.remove(slide_id)
+        for slide_id in order:
+            slide_id_list.append(slide_id)
+        for slide_id in old_slide_ids:
+            if slide_id not in order:
+                prs.part.drop_rel(slide_id.rId)
+
+        buffer = io.BytesIO()
+        prs.save(buffer)
+        data = buffer.getvalue()
+        self._remember(self._decks, session_id, {"pptx": data, "layout": layout}, self._max_decks)
+
+        if isinstance(output, str):
+            with open(output, 'wb') as f:
+                f.write(data)
+        else:
+            output.write(data)
+        return rendered
+
+render_cache = RenderCache()
+
+def create_powerpoint(course_content: str, filename: str, session_id: str = None) -> bool:
+    """
+    Create a PowerPoint presentation from course content.
+    With a session_id, only modules changed since the session's last deck are re-rendered.
+    """
+    try:
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        prs.save(filepath)
+        if session_id:
+            units = split_course_units(course_content)
+            rendered = render_cache.render_powerpoint(session_id, units, filepath)
+            logger.info(f"Session {session_id}: re-rendered {rendered}/{len(units)} units for PowerPoint")
+        else:
+            render_powerpoint(parse_course_content(course_content), filepath)
         return True
-        
     except Exception as e:
         logger.error(f"PowerPoint creation error: {e}")
         return False
 
-def create_pdf(course_content: str, filename: str) -> bool:
-    """Create a PDF document from course content"""
+def create_pdf(course_content: str, filename: str, session_id: str = None) -> bool:
+    """
+    Create a PDF document from course content.
+    With a session_id, cached fragments are reused for unchanged modules.
+    """
     try:
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        doc = SimpleDocTemplate(filepath, pagesize=letter)
-        styles = getSampleStyleSheet()
-        story = []
-        
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.darkblue
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontSize=16,
-            spaceAfter=12,
-            textColor=colors.darkgreen
-        )
-        
-        # Add title
-        story.append(Paragraph("AI Generated Course Content", title_style))
-        story.append(Spacer(1, 20))
-        
-        # Process content
-        lines = course_content.split('\n')
-        for line in lines:
-            line = line.strip()
-            if not line:
-                story.append(Spacer(1, 6))
-                continue
-            
-            # Format based on content type
-            if (line.startswith('#') or 
-                line.upper().startswith('MODULE') or 
-                line.upper().startswith('SECTION')):
-                story.append(Paragraph(line.replace('#', '').strip(), heading_style))
-            else:
-                story.append(Paragraph(line, styles['Normal']))
-            
-            story.append(Spacer(1, 6))
-        
-        # Build PDF
-        doc.build(story)
+        if session_id:
+            units = split_course_units(course_content)
+            rendered = render_cache.render_pdf(units, filepath)
+            logger.info(f"Session {session_id}: re-rendered {rendered}/{len(units)} units for PDF")
+        else:
+            render_pdf(parse_course_content(course_content), filepath)
         return True
-        
     except Exception as e:
         logger.error(f"PDF creation error: {e}")
         return False
 
+def create_lab_sheet(course_content: str, filename: str) -> bool:
+    """Create a PDF lab instruction sheet from course content"""
+    try:
+        render_lab_sheet(parse_course_content(course_content), os.path.join(UPLOAD_FOLDER, filename))
+        return True
+    except Exception as e:
+        logger.error(f"Lab sheet creation error: {e}")
+        return False
+
+class ZipStream:
+    """Write-only, unseekable file object that buffers zip output until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _render_to_bytes(render) -> bytes:
+    buffer = io.BytesIO()
+    render(buffer)
+    return buffer.getvalue()
+
+def export_renderers(course_content: str, formats: list, session_id: str = None) -> dict:
+    """
+    Map each format to a callable writing it to a file object. The course is
+    parsed once for all formats; with a session_id the PPTX and PDF renders go
+    through the incremental render cache.
+    """
+    units = split_course_units(course_content)
+    sections = [section for unit in units for section in unit["sections"]]
+    renderers = {fmt: partial(EXPORT_RENDERERS[fmt], sections) for fmt in formats}
+    if session_id:
+        if 'pptx' in renderers:
+            renderers['pptx'] = partial(render_cache.render_powerpoint, session_id, units)
+        if 'pdf' in renderers:
+            renderers['pdf'] = partial(render_cache.render_pdf, units)
+    return renderers
+
+def stream_export_zip(renderers: dict):
+    """
+    Render the requested formats concurrently and yield a ZIP archive as it is built.
+    Each file is added as soon as its render finishes, so the archive itself is
+    never held in memory or written to disk. Failed renders are listed in
+    export_errors.txt instead of aborting the download.
+    """
+    sink = ZipStream()
+    executor = ThreadPoolExecutor(max_workers=len(renderers))
+    futures = {executor.submit(_render_to_bytes, render): fmt for fmt, render in renderers.items()}
+    failed = []
+
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for future in as_completed(futures):
+                fmt = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.error(f"Export render error ({fmt}): {e}")
+                    failed.append(f"{fmt}: {e}")
+                    continue
+
+                with archive.open(EXPORT_FORMATS[fmt], 'w') as entry:
+                    for start in range(0, len(data), EXPORT_CHUNK_SIZE):
+                        entry.write(data[start:start + EXPORT_CHUNK_SIZE])
+                        chunk = sink.drain()
+                        if chunk:
+                            yield chunk
+
+            if failed:
+                archive.writestr('export_errors.txt', '\n'.join(failed) + '\n')
+
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _request_course(data: dict) -> tuple:
+    """
+    Course content and session for an export request: the posted course_content,
+    or the session's stored course when only a session_id is given.
+    """
+    if not data:
+        return None, None
+    session_id = data.get('session_id')
+    course_content = data.get('course_content')
+    if course_content is None and session_id:
+        course_content = session_store.get_course(session_id)
+    return course_content, session_id
+
 @app.route('/generate_ppt', methods=['POST'])
 def generate_ppt():
     try:
         data = request.get_json()
-        if not data or 'course_content' not in data:
+        course_content, session_id = _request_course(data)
+        if course_content is None:
             return jsonify({"success": False, "error": "Course content is required"}), 400
-        
-        course_content = data['course_content']
+
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         filename = f"course_{timestamp}.pptx"
-        
-        if create_powerpoint(course_content, filename):
+
+        if create_powerpoint(course_content, filename, session_id):
             return jsonify({
                 "success": True,
                 "filename": filename,
@@ -366,7 +1739,7 @@ def generate_ppt():
             })
         else:
             return jsonify({"success": False, "error": "Failed to create PowerPoint"}), 500
-            
+
     except Exception as e:
         logger.error(f"PPT generation error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -375,14 +1748,14 @@ def generate_ppt():
 def generate_pdf():
     try:
         data = request.get_json()
-        if not data or 'course_content' not in data:
+        course_content, session_id = _request_course(data)
+        if course_content is None:
             return jsonify({"success": False, "error": "Course content is required"}), 400
-        
-        course_content = data['course_content']
+
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         filename = f"course_{timestamp}.pdf"
-        
-        if create_pdf(course_content, filename):
+
+        if create_pdf(course_content, filename, session_id):
             return jsonify({
                 "success": True,
                 "filename": filename,
@@ -390,11 +1763,67 @@ def generate_pdf():
             })
         else:
             return jsonify({"success": False, "error": "Failed to create PDF"}), 500
-            
+
     except Exception as e:
         logger.error(f"PDF generation error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/generate_lab_sheet', methods=['POST'])
+def generate_lab_sheet():
+    try:
+        data = request.get_json()
+        course_content, session_id = _request_course(data)
+        if course_content is None:
+            return jsonify({"success": False, "error": "Course content is required"}), 400
+
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        filename = f"lab_sheet_{timestamp}.pdf"
+
+        if create_lab_sheet(course_content, filename):
+            return jsonify({
+                "success": True,
+                "filename": filename,
+                "download_url": f"/download/{filename}"
+            })
+        else:
+            return jsonify({"success": False, "error": "Failed to create lab sheet"}), 500
+
+    except Exception as e:
+        logger.error(f"Lab sheet generation error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/export', methods=['POST'])
+def export_course():
+    try:
+        data = request.get_json()
+        course_content, session_id = _request_course(data)
+        if course_content is None:
+            return jsonify({"success": False, "error": "Course content is required"}), 400
+
+        formats = data.get('formats') or list(EXPORT_FORMATS)
+        if not isinstance(formats, list):
+            return jsonify({"success": False, "error": "Formats must be a list"}), 400
+        unknown = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+        if unknown:
+            return jsonify({
+                "success": False,
+                "error": f"Unsupported formats: {', '.join(map(str, unknown))}",
+                "supported_formats": list(EXPORT_FORMATS)
+            }), 400
+
+        renderers = export_renderers(course_content, list(dict.fromkeys(formats)), session_id)
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+
+        return Response(
+            stream_export_zip(renderers),
+            mimetype='application/zip',
+            headers={"Content-Disposition": f"attachment; filename=course_{timestamp}.zip"}
+        )
+
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
@@ -424,4 +1853,7 @@ def list_files():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if '--backfill-search' in sys.argv:
+        print(f"Indexed {search_index.backfill_decks()} existing decks from {UPLOAD_FOLDER}")
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
@@ -8,6 +8,8 @@ function ChatInterface({ setHistory }) {
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
   const [rateLimitInfo, setRateLimitInfo] = useState(null);
+  // Issued by the server on the first message; follow-ups edit that session's course
+  const [sessionId, setSessionId] = useState(null);
   const inputRef = useRef();
 
   const sendMessage = async () => {
@@ -20,9 +22,13 @@ function ChatInterface({ setHistory }) {
     setInput('');
     
     try {
-      const res = await axios.post('http://localhost:5000/chat', { message: userMessage });
+      const res = await axios.post('http://localhost:5000/chat', {
+        message: userMessage,
+        ...(sessionId && { session_id: sessionId })
+      });
       
       if (res.data.success) {
+        setSessionId(res.data.session_id);
         const aiResponse = res.data.response;
         setMessages((prev) => [...prev, { ai: aiResponse }]);
         setHistory((prev) => [...prev, { user: userMessage, ai: aiResponse }]);
@@ -65,6 +71,13 @@ function ChatInterface({ setHistory }) {
     inputRef.current?.focus();
   };
 
+  const startNewCourse = () => {
+    setSessionId(null);
+    setMessages([]);
+    setRateLimitInfo(null);
+    inputRef.current?.focus();
+  };
+
   return (
     <div className="chat-interface">
       {rateLimitInfo && (
@@ -102,6 +115,11 @@ function ChatInterface({ setHistory }) {
         />        <button onClick={sendMessage} disabled={loading || !input.trim()}>
           {loading ? 'Generating...' : 'Send'}
         </button>
+        {sessionId && (
+          <button onClick={startNewCourse} disabled={loading}>
+            New course
+          </button>
+        )}
       </div>
     </div>
   );
@@ -4,11 +4,17 @@ const api = axios.create({
   baseURL: 'http://localhost:5000',
 });
 
-export const sendChat = (message, session_id) =>
-  api.post('/chat', { message, session_id });
+export const sendChat = (message, session_id, options = {}) =>
+  api.post('/chat', { message, session_id, ...options });
 
-export const getHistory = (session_id) =>
-  api.get('/history', { params: { session_id } });
+export const getQueueStatus = () =>
+  api.get('/queue');
+
+export const getHistory = (session_id, page = 1, per_page = 20) =>
+  api.get('/history', { params: { session_id, page, per_page } });
+
+export const regenerateModule = (session_id, module, part = 'module', instructions, slide) =>
+  api.post('/regenerate_module', { session_id, module, part, instructions, slide });
 
 export const generatePPT = (course_content) =>
   api.post('/generate_ppt', { course_content });
@@ -19,12 +25,18 @@ export const generatePDF = (course_content) =>
 export const generateLabSheet = (course_content) =>
   api.post('/generate_lab_sheet', { course_content });
 
+export const exportCourse = (course_content, formats) =>
+  api.post('/export', { course_content, formats }, { responseType: 'blob' });
+
 export const downloadFile = (file_id) =>
   api.get(`/download/${file_id}`, { responseType: 'blob' });
 
 export const listFiles = () =>
   api.get('/files');
 
+export const searchCourses = (q, page = 1, per_page = 10) =>
+  api.get('/search', { params: { q, page, per_page } });
+
 export const listCourses = () =>
   api.get('/courses');
 
@@ -1,5 +1,7 @@
-import requests
+import io
 import json
+import zipfile
+import requests
 
 # Test the backend API endpoints
 BASE_URL = "http://localhost:5000"
@@ -30,6 +32,53 @@ def test_backend():
     except Exception as e:
         print(f"✗ Chat test failed: {e}")
     
+    # Test 2a: Regenerate a single module of the session's course
+    try:
+        response = requests.post(f"{BASE_URL}/regenerate_module", 
+                               json={"session_id": "test", "module": 1, "instructions": "Make it more advanced"},
+                               timeout=30)
+        if response.status_code == 200:
+            print(f"✓ Module regeneration working - changed: {response.json().get('changed_modules')}")
+        else:
+            print(f"✗ Module regeneration error: {response.json()}")
+    except Exception as e:
+        print(f"✗ Module regeneration test failed: {e}")
+    
+    # Test 2b: Session history
+    try:
+        response = requests.get(f"{BASE_URL}/history", 
+                              params={"session_id": "test", "per_page": 5})
+        if response.status_code == 200:
+            history = response.json()
+            print(f"✓ History endpoint working - {history['total']} turns in session")
+        else:
+            print(f"✗ History endpoint error: {response.json()}")
+    except Exception as e:
+        print(f"✗ History test failed: {e}")
+    
+    # Test 2c: Scheduler queue status
+    try:
+        response = requests.get(f"{BASE_URL}/queue")
+        if response.status_code == 200:
+            print(f"✓ Queue endpoint working - depth {response.json()['queue_depth']}")
+        else:
+            print(f"✗ Queue endpoint error: {response.status_code}")
+    except Exception as e:
+        print(f"✗ Queue test failed: {e}")
+    
+    # Test 2d: Full-text search over generated courses
+    try:
+        response = requests.get(f"{BASE_URL}/search", params={"q": "python", "per_page": 5})
+        if response.status_code == 200:
+            print(f"✓ Search endpoint working - {response.json()['total']} matches")
+            for result in response.json()["results"][:1]:
+                course = requests.get(f"{BASE_URL}/course/{result['course_id']}").json()
+                print(f"✓ Course lookup working - {course.get('course_title')}, {len(course.get('modules', []))} units")
+        else:
+            print(f"✗ Search endpoint error: {response.json()}")
+    except Exception as e:
+        print(f"✗ Search test failed: {e}")
+    
     # Test 3: Test file generation endpoints
     test_content = "# Course: Python Basics\n\n## Module 1: Introduction\n- Variables\n- Data types\n\n## Module 2: Control Flow\n- Loops\n- Conditionals"
     
@@ -57,6 +106,31 @@ def test_backend():
     except Exception as e:
         print(f"✗ PowerPoint test failed: {e}")
     
+    try:
+        # Test lab sheet generation
+        response = requests.post(f"{BASE_URL}/generate_lab_sheet", 
+                               json={"course_content": test_content})
+        if response.status_code == 200:
+            print("✓ Lab sheet generation working")
+            print(f"Lab sheet info: {response.json()}")
+        else:
+            print(f"✗ Lab sheet generation failed: {response.json()}")
+    except Exception as e:
+        print(f"✗ Lab sheet test failed: {e}")
+    
+    try:
+        # Test multi-format ZIP export
+        response = requests.post(f"{BASE_URL}/export", 
+                               json={"course_content": test_content, "formats": ["pptx", "pdf", "lab_sheet"]},
+                               stream=True)
+        if response.status_code == 200:
+            archive = zipfile.ZipFile(io.BytesIO(response.content))
+            print(f"✓ Export working - {archive.namelist()}")
+        else:
+            print(f"✗ Export failed: {response.json()}")
+    except Exception as e:
+        print(f"✗ Export test failed: {e}")
+    
     # Test 4: List files
     try:
         response = requests.get(f"{BASE_URL}/files")